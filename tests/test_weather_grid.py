@@ -0,0 +1,214 @@
+import threading
+import time
+import numpy as np
+import pytest
+import weather_grid
+from weather_grid import RateLimiter, GridTileCache, build_grid_cells, get_grid_cells, fetch_grid_cells, assemble_grid_arrays, colorize_grid
+
+def fake_conditions(cell: tuple) -> tuple:
+    # temperature is the latitude cell, so every row can be told apart
+    return (float(cell[0]), 0.0, 'Clear', 0, 0, 0, 0)
+
+@pytest.fixture
+def fetched(monkeypatch) -> list:
+    '''
+    Replaces network requests with fake conditions, recording every cell requested
+    '''
+    requested = []
+    lock = threading.Lock()
+
+    def fake_fetch_grid_point(cell: tuple, api_key: str, units: str) -> tuple:
+        with lock:
+            requested.append(cell)
+        return fake_conditions(cell), None
+
+    monkeypatch.setattr(weather_grid, 'fetch_grid_point', fake_fetch_grid_point)
+    return requested
+
+def test_rate_limiter_spaces_out_threads():
+    limiter = RateLimiter(20)
+    starts = []
+    lock = threading.Lock()
+
+    def call():
+        limiter.wait()
+        with lock:
+            starts.append(time.monotonic())
+
+    threads = [threading.Thread(target=call) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    starts.sort()
+    gaps = np.diff(starts)
+    assert len(starts) == 5
+    assert (gaps >= 0.04).all()
+
+def test_build_grid_cells_snaps_to_resolution():
+    lat_cells, lon_cells = build_grid_cells((39.1, -75.3, 40.9, -73.2), 0.25)
+
+    # 39.25 to 40.75 from north to south, and -75.25 to -73.25 from west to east
+    assert lat_cells.tolist() == [815, 810, 805, 800, 795, 790, 785]
+    assert lon_cells.tolist() == [-1505, -1500, -1495, -1490, -1485, -1480, -1475, -1470, -1465]
+
+    # a box offset from the lattice still lands on the same points
+    panned_lat_cells, panned_lon_cells = build_grid_cells((39.2, -75.2, 41.0, -73.1), 0.25)
+    assert set(panned_lat_cells) <= set(lat_cells) | {820}
+    assert set(panned_lon_cells) <= set(lon_cells) | {-1460}
+
+def test_build_grid_cells_empty_when_smaller_than_resolution():
+    lat_cells, lon_cells = build_grid_cells((40.01, -74.09, 40.09, -74.01), 0.25)
+    assert len(lat_cells) * len(lon_cells) == 0
+
+def test_fine_resolution_shares_cache_cells(fetched):
+    lat_cells, lon_cells = build_grid_cells((40.0, -74.1, 40.1, -74.0), 0.01)
+    cells = get_grid_cells(lat_cells, lon_cells)
+
+    assert len(lat_cells) * len(lon_cells) == 121
+    assert len(cells) == 9
+
+    cell_data, failed_cells = fetch_grid_cells(list(cells), 'key', 'metric', RateLimiter(1000))
+    assert sorted(fetched) == sorted(cells)
+    assert failed_cells == {}
+
+    # every point is filled in from the cell it shares with its neighbors
+    temperatures, precipitation, conditions = assemble_grid_arrays(lat_cells, lon_cells, cell_data)
+    assert not np.isnan(temperatures).any()
+    assert temperatures[0, 0] == temperatures[1, 0] == lat_cells[0]
+
+def test_fetch_grid_cells_reports_failures_and_progress(monkeypatch):
+    failing_cell = (800, -1480)
+    monkeypatch.setattr(weather_grid, 'fetch_grid_point', lambda cell, api_key, units: (None, 429) if cell == failing_cell else (fake_conditions(cell), None))
+    progress = []
+
+    cells = [(800, -1485), failing_cell, (805, -1480)]
+    cell_data, failed_cells = fetch_grid_cells(cells, 'key', 'metric', RateLimiter(1000), lambda done, total: progress.append((done, total)))
+
+    assert set(cell_data) == {(800, -1485), (805, -1480)}
+    assert failed_cells == {failing_cell: 429}
+    assert progress == [(1, 3), (2, 3), (3, 3)]
+
+def test_fetch_grid_cells_stops_once_canceled(monkeypatch):
+    stop = threading.Event()
+    requested = []
+
+    def fake_fetch_grid_point(cell: tuple, api_key: str, units: str) -> tuple:
+        requested.append(cell)
+        stop.set()
+        return fake_conditions(cell), None
+
+    monkeypatch.setattr(weather_grid, 'fetch_grid_point', fake_fetch_grid_point)
+
+    # the other workers are still waiting on the limiter when the first
+    # request cancels the fetch
+    cells = [(800, lon_cell) for lon_cell in range(20)]
+    cell_data, failed_cells = fetch_grid_cells(cells, 'key', 'metric', RateLimiter(20), stop=stop)
+
+    assert len(requested) == 1
+    assert list(cell_data) == requested
+    # skipped cells are not failures
+    assert failed_cells == {}
+
+def test_fetch_grid_cells_canceled_before_starting(fetched):
+    stop = threading.Event()
+    stop.set()
+
+    cell_data, failed_cells = fetch_grid_cells([(800, -1480), (805, -1480)], 'key', 'metric', RateLimiter(1000), stop=stop)
+
+    assert fetched == []
+    assert cell_data == {}
+    assert failed_cells == {}
+
+class FakeResponse:
+    def __init__(self, status_code: int, api: dict=None):
+        self.status_code = status_code
+        self.api = api
+
+    def __bool__(self) -> bool:
+        return self.status_code < 400
+
+    def json(self) -> dict:
+        return self.api
+
+@pytest.mark.parametrize('status_code', [401, 429])
+def test_fetch_grid_point_reports_status_code(monkeypatch, status_code):
+    monkeypatch.setattr(weather_grid.requests, 'get', lambda url, timeout: FakeResponse(status_code, {'cod': status_code}))
+    assert weather_grid.fetch_grid_point((800, -1480), 'key', 'metric') == (None, status_code)
+
+def test_fetch_grid_point_reports_exception_name(monkeypatch):
+    def timeout(url, timeout):
+        raise weather_grid.requests.exceptions.ReadTimeout()
+
+    monkeypatch.setattr(weather_grid.requests, 'get', timeout)
+    assert weather_grid.fetch_grid_point((800, -1480), 'key', 'metric') == (None, 'ReadTimeout')
+
+def test_fetch_grid_point_parses_conditions(monkeypatch):
+    api = {'main': {'temp': 21.5}, 'rain': {'1h': 0.4}, 'weather': [{'main': 'Rain'}], 'dt': 3, 'sys': {'sunrise': 1, 'sunset': 5}, 'clouds': {'all': 90}}
+    monkeypatch.setattr(weather_grid.requests, 'get', lambda url, timeout: FakeResponse(200, api))
+    assert weather_grid.fetch_grid_point((800, -1480), 'key', 'metric') == ((21.5, 0.4, 'Rain', 3, 1, 5, 90), None)
+
+def test_assemble_grid_arrays_leaves_missing_points_nan():
+    lat_cells = np.array([805, 800])
+    lon_cells = np.array([-1485, -1480])
+    cell_data = {(805, -1485): (10.0, 0.5, 'Rain', 1, 2, 3, 4), (800, -1480): (20.0, 0.0, 'Clear', 1, 2, 3, 4)}
+
+    temperatures, precipitation, conditions = assemble_grid_arrays(lat_cells, lon_cells, cell_data)
+
+    np.testing.assert_array_equal(temperatures, [[10.0, np.nan], [np.nan, 20.0]])
+    np.testing.assert_array_equal(precipitation, [[0.5, np.nan], [np.nan, 0.0]])
+    assert conditions == [[('Rain', 1, 2, 3, 4), None], [None, ('Clear', 1, 2, 3, 4)]]
+
+def test_colorize_grid_temperature():
+    values = np.array([[0.0, 30.0], [np.nan, 15.0]])
+    rgb = colorize_grid(values)
+
+    assert rgb.shape == (2, 2, 3)
+    assert rgb.dtype == np.uint8
+    assert tuple(rgb[0, 0]) == tuple(weather_grid.TEMPERATURE_HEATMAP_COLORS[0])
+    assert tuple(rgb[0, 1]) == tuple(weather_grid.TEMPERATURE_HEATMAP_COLORS[-1])
+    assert tuple(rgb[1, 0]) == weather_grid.HEATMAP_MISSING_COLOR
+
+def test_colorize_grid_precipitation_relative_to_zero():
+    # a uniformly dry grid stays dry instead of being stretched to full color
+    rgb = colorize_grid(np.zeros((2, 3)), temperature_chart=False)
+    assert (rgb == weather_grid.PRECIPITATION_HEATMAP_COLORS[0]).all()
+
+    rgb = colorize_grid(np.array([[0.0, 4.0]]), temperature_chart=False)
+    assert tuple(rgb[0, 1]) == tuple(weather_grid.PRECIPITATION_HEATMAP_COLORS[-1])
+
+def test_tile_cache_reused_on_pan(fetched):
+    cache = GridTileCache()
+    lat_cells, lon_cells = build_grid_cells((40.0, -75.0, 41.0, -74.0), 0.25)
+    cells = get_grid_cells(lat_cells, lon_cells)
+
+    cell_data, missing_cells = cache.lookup(cells, 'metric')
+    assert cell_data == {}
+    fetched_data, failed_cells = fetch_grid_cells(missing_cells, 'key', 'metric', RateLimiter(1000))
+    cache.store(fetched_data, 'metric', 0)
+    assert len(fetched) == 25
+
+    # panning east by half of the box only needs the two new columns
+    panned_lat_cells, panned_lon_cells = build_grid_cells((40.0, -74.5, 41.0, -73.5), 0.25)
+    panned_cells = get_grid_cells(panned_lat_cells, panned_lon_cells)
+    cell_data, missing_cells = cache.lookup(panned_cells, 'metric')
+    assert len(cell_data) == 15
+    assert sorted(missing_cells) == sorted(cell for cell in panned_cells if cell[1] > -1480)
+
+    # different units are cached separately
+    cell_data, missing_cells = cache.lookup(panned_cells, 'imperial')
+    assert len(missing_cells) == 25
+
+def test_tile_cache_prunes_stale_cells():
+    cache = GridTileCache(ttl=600)
+    cache.store({(800, -1480): fake_conditions((800, -1480))}, 'metric', 0)
+    cache.store({(820, -1480): fake_conditions((820, -1480))}, 'metric', 500)
+
+    cache.prune(700)
+    cell_data, missing_cells = cache.lookup({(800, -1480), (820, -1480)}, 'metric')
+
+    assert list(cell_data) == [(820, -1480)]
+    assert missing_cells == [(800, -1480)]
+    # the stale cell's tile is dropped once it is empty
+    assert len(cache.tiles) == 1
@@ -3,19 +3,56 @@ from types import NoneType
 import requests
 import json
 import datetime
+import time
+import threading
 from collections import Counter
 import math
+import numpy as np
 import uszipcode as zc
 import pycountry
-from PyQt5.QtGui import QPixmap, QPainter, QLinearGradient, QColor, QGradient, QPalette, QIcon
-from PyQt5.QtWidgets import QMainWindow, QLabel, QMessageBox, QLineEdit, QFileDialog, QApplication
+from weather_grid import RateLimiter, GridTileCache, build_grid_cells, get_grid_cells, fetch_grid_cells, assemble_grid_arrays, colorize_grid
+from weather_grid import GRID_DEFAULT_SPAN, GRID_DEFAULT_RESOLUTION, GRID_MIN_RESOLUTION, GRID_MAX_POINTS, GRID_MAX_REQUESTS, GRID_REQUESTS_PER_SECOND
+from PyQt5.QtGui import QPixmap, QPainter, QLinearGradient, QColor, QGradient, QPalette, QIcon, QImage
+from PyQt5.QtWidgets import QMainWindow, QLabel, QMessageBox, QLineEdit, QFileDialog, QApplication, QInputDialog, QProgressDialog
 from PyQt5 import uic
-from PyQt5.QtCore import Qt, QPoint
+from PyQt5.QtCore import Qt, QPoint, QThread, pyqtSignal
 from PyQt5.QtChart import QChart, QLineSeries, QValueAxis, QCategoryAxis
 import qdarkstyle
 
 BASE_API_URL = "https://api.openweathermap.org/"
 
+# smallest icon size, in pixels, worth drawing on top of the heatmap
+GRID_MIN_ICON_SIZE = 8
+
+class GridFetchThread(QThread):
+    progress = pyqtSignal(int, int)
+
+    def __init__(self, cells: list, api_key: str, units: str, limiter: RateLimiter, parent=None):
+        '''
+        Fetches regional grid cells off of the GUI thread. Results are kept on
+        the thread to be collected once finished is emitted, and setting
+        stop_event skips any requests not yet made
+
+        :param cells: list of cache cells to fetch
+        :param api_key: given api_key
+        :param units: selected units
+        :param limiter: rate limiter shared by every request
+        '''
+        super(GridFetchThread, self).__init__(parent)
+        self.cells = cells
+        self.api_key = api_key
+        self.units = units
+        self.limiter = limiter
+        self.stop_event = threading.Event()
+        self.cell_data = {}
+        self.failed_cells = {}
+
+    def run(self) -> None:
+        '''
+        Fetches every cell, emitting progress after each request
+        '''
+        self.cell_data, self.failed_cells = fetch_grid_cells(self.cells, self.api_key, self.units, self.limiter, self.progress.emit, self.stop_event)
+
 class WeatherGUI(QMainWindow):
     def __init__(self):
         super(WeatherGUI, self).__init__()
@@ -34,19 +71,38 @@ class WeatherGUI(QMainWindow):
         # initializes the temp and precipitation field to reduce api requests
         self.temp_and_precip_data = None
 
+        # initializes the regional grid fields. fetched conditions are cached
+        # per tile to make panning cheap
+        self.grid_bounds = None
+        self.grid_resolution = GRID_DEFAULT_RESOLUTION
+        self.grid_tile_cache = GridTileCache()
+        self.grid_rate_limiter = RateLimiter(GRID_REQUESTS_PER_SECOND)
+        self.grid_data = None
+        self.grid_pending = None
+        self.grid_fetch_thread = None
+        self.grid_progress_dialog = None
+
         self.get_weather.clicked.connect(self.load_weather)
         # added lambdas to pass through arguments
         self.set_default_action.triggered.connect(lambda checked, default=True: self.save_data(default))
         self.save_json_action.triggered.connect(lambda checked, default=False: self.save_data(default))
         self.load_default_action.triggered.connect(lambda checked, default=True: self.load_data(default))
         self.load_json_action.triggered.connect(lambda checked, default=False: self.load_data(default))
-        self.temperature_tool_button.clicked.connect(lambda checked, temp=True: self.display_forecast_linechart(self.temp_and_precip_data, temp))
-        self.precipitation_tool_button.clicked.connect(lambda checked, temp=False: self.display_forecast_linechart(self.temp_and_precip_data, temp))
+        self.temperature_tool_button.clicked.connect(lambda checked, temp=True: self.display_forecast_view(temp))
+        self.precipitation_tool_button.clicked.connect(lambda checked, temp=False: self.display_forecast_view(temp))
+        self.region_tool_button.clicked.connect(self.toggle_grid_heatmap)
+        self.load_grid_action.triggered.connect(self.load_grid_weather)
+        self.pan_north_action.triggered.connect(lambda checked, lat=1, lon=0: self.pan_grid(lat, lon))
+        self.pan_south_action.triggered.connect(lambda checked, lat=-1, lon=0: self.pan_grid(lat, lon))
+        self.pan_west_action.triggered.connect(lambda checked, lat=0, lon=-1: self.pan_grid(lat, lon))
+        self.pan_east_action.triggered.connect(lambda checked, lat=0, lon=1: self.pan_grid(lat, lon))
 
         # hides elements that do not yet need to be seen
         self.temperature_forecast_chart.hide()
         self.temperature_tool_button.hide()
         self.precipitation_tool_button.hide()
+        self.region_tool_button.hide()
+        self.regional_heatmap_label.hide()
 
         # checks if user data already exists. if so, loads it
         if os.path.exists('./user.json'):
@@ -83,6 +139,20 @@ class WeatherGUI(QMainWindow):
         :param sunset: approximate sunset time in unix time
         :param cloud_percentage: current cloudiness percentage, 0-100
         '''
+        file = self.get_weather_icon_path(weather, dt, sunrise, sunset, cloud_percentage)
+        label.setPixmap(QPixmap(file))
+
+    def get_weather_icon_path(self, weather: str, dt: int, sunrise: int, sunset: int, cloud_percentage: int) -> str:
+        '''
+        Determines the weather icon to use for a particular weather state
+
+        :param weather: current weather
+        :param dt: current time in unix time
+        :param sunrise: approximate sunrise time in unix time
+        :param sunset: approximate sunset time in unix time
+        :param cloud_percentage: current cloudiness percentage, 0-100
+        :return: path to the matching icon
+        '''
 
         file = "icons/inverted/"
         # 15 minute time offset in unix UTC
@@ -122,7 +192,7 @@ class WeatherGUI(QMainWindow):
             case other:
                 file += 'rainy-day.png'
             
-        label.setPixmap(QPixmap(file))
+        return file
 
     def change_extra_icon(self, weather: str, temp_and_units: tuple) -> None:
         '''
@@ -510,6 +580,7 @@ class WeatherGUI(QMainWindow):
         self.temperature_forecast_chart.setChart(chart)
         self.temperature_forecast_chart.setRenderHint(QPainter.Antialiasing)
 
+        self.regional_heatmap_label.hide()
         self.temperature_forecast_chart.show()
 
         # now that the forecast has been displayed, we can show the buttons for the different graphs
@@ -585,6 +656,330 @@ class WeatherGUI(QMainWindow):
             self.change_weather_icon(weather_labels[i], weather, dt, sunrise, sunset, cloud_percentage)
             temperature_labels[i].setText(temp)
         
+    def display_forecast_view(self, temperature_chart: bool=True) -> None:
+        '''
+        Displays temperature or precipitation data in whichever view, the
+        forecast linechart or the regional heatmap, is currently shown
+
+        :param temperature_chart: determines if the view shows temperature or
+                                  precipitation. defaults to True
+        '''
+        if self.regional_heatmap_label.isVisible():
+            self.display_grid_heatmap(temperature_chart)
+        else:
+            self.display_forecast_linechart(self.temp_and_precip_data, temperature_chart)
+
+    def toggle_grid_heatmap(self) -> None:
+        '''
+        Switches between the forecast linechart and the regional heatmap
+        '''
+        # the linechart can only be switched back to if a forecast was loaded
+        if self.regional_heatmap_label.isVisible() and self.temp_and_precip_data is not None:
+            self.display_forecast_linechart(self.temp_and_precip_data)
+        else:
+            self.display_grid_heatmap()
+
+    def load_grid_weather(self) -> None:
+        '''
+        Asks for a bounding box and resolution, then loads and displays the
+        regional weather grid
+        '''
+        # waits for the current fetch to finish before starting another
+        if self.grid_fetch_thread is not None:
+            return
+
+        try:
+            zip_code, api_key = self.check_fields()
+        except ValueError as e:
+            # changes nothing about current setup if error is raised
+            print(e)
+            return
+
+        # centers the bounding box on the selected zip code if no grid has been loaded yet
+        bounds = self.grid_bounds
+        if bounds is None:
+            country_name = self.country_combo_box.currentText()
+            country_code = pycountry.countries.get(name=country_name).alpha_2
+            try:
+                lat, lon = self.get_lat_and_lon(zip_code, country_code, api_key)
+            except TypeError:
+                # should only catch any time a request returns a NoneType
+                self.determine_typeerror_cause()
+                return
+            half_span = GRID_DEFAULT_SPAN / 2
+            bounds = (lat - half_span, lon - half_span, lat + half_span, lon + half_span)
+
+        bounds_text = ', '.join(f'{value:.2f}' for value in bounds)
+        bounds_text, ok = QInputDialog.getText(self, 'Regional Grid', 'Bounding box (south, west, north, east):', QLineEdit.Normal, bounds_text)
+        if not ok:
+            return
+        resolution, ok = QInputDialog.getDouble(self, 'Regional Grid', 'Resolution (degrees):', self.grid_resolution, GRID_MIN_RESOLUTION, GRID_DEFAULT_SPAN * 5, 2)
+        if not ok:
+            return
+
+        try:
+            south, west, north, east = (float(value) for value in bounds_text.split(','))
+        except ValueError:
+            self.show_error_message("Bounding box must be four numbers: south, west, north, east.")
+            return
+        if not (-90 <= south < north <= 90 and -180 <= west < east <= 180):
+            self.show_error_message("Bounding box is not valid! Make sure south is below north, west is before east, and all values are real coordinates.")
+            return
+
+        self.grid_resolution = resolution
+        self.update_grid((south, west, north, east), api_key)
+
+    def pan_grid(self, lat_direction: int, lon_direction: int) -> None:
+        '''
+        Moves the regional grid by half of its size in a given direction
+
+        :param lat_direction: 1 to pan north, -1 to pan south, 0 otherwise
+        :param lon_direction: 1 to pan east, -1 to pan west, 0 otherwise
+        '''
+        if self.grid_bounds is None:
+            return
+
+        try:
+            zip_code, api_key = self.check_fields()
+        except ValueError as e:
+            # changes nothing about current setup if error is raised
+            print(e)
+            return
+
+        south, west, north, east = self.grid_bounds
+        lat_shift = (north - south) / 2 * lat_direction
+        lon_shift = (east - west) / 2 * lon_direction
+        # keeps the bounding box within real coordinates
+        lat_shift = min(max(lat_shift, -90 - south), 90 - north)
+        lon_shift = min(max(lon_shift, -180 - west), 180 - east)
+
+        self.update_grid((south + lat_shift, west + lon_shift, north + lat_shift, east + lon_shift), api_key)
+
+    def update_grid(self, bounds: tuple, api_key: str) -> None:
+        '''
+        Starts fetching weather for every point of the regional grid. Cells
+        that are not cached are fetched on a worker thread, and the heatmap
+        is displayed once they arrive
+
+        :param bounds: tuple of the south, west, north, and east edges of the grid
+        :param api_key: given api_key
+        '''
+        # only one fetch runs at a time, so pans are ignored until it finishes
+        if self.grid_fetch_thread is not None:
+            return
+
+        units = None
+        # returns units in metric
+        if self.metric_radio.isChecked():
+            units = "metric"
+        # returns units in imperial
+        elif self.imperial_radio.isChecked():
+            units = "imperial"
+
+        lat_cells, lon_cells = build_grid_cells(bounds, self.grid_resolution)
+        if len(lat_cells) * len(lon_cells) == 0:
+            self.show_error_message("Bounding box is smaller than the grid resolution! Try a larger bounding box or a finer resolution.")
+            return
+        if len(lat_cells) * len(lon_cells) > GRID_MAX_POINTS:
+            self.show_error_message(f"The regional grid is limited to {GRID_MAX_POINTS} points! Try a smaller bounding box or a coarser resolution.")
+            return
+        cells = get_grid_cells(lat_cells, lon_cells)
+        if len(cells) > GRID_MAX_REQUESTS:
+            self.show_error_message(f"The regional grid is limited to {GRID_MAX_REQUESTS} requests! Try a smaller bounding box or a coarser resolution.")
+            return
+
+        self.grid_tile_cache.prune(time.time())
+        cell_data, missing_cells = self.grid_tile_cache.lookup(cells, units)
+        self.grid_pending = (bounds, lat_cells, lon_cells, units, cell_data)
+        if not missing_cells:
+            self.finish_grid_update({}, {})
+            return
+
+        self.grid_fetch_thread = GridFetchThread(missing_cells, api_key, units, self.grid_rate_limiter, self)
+        self.grid_fetch_thread.finished.connect(self.finish_grid_fetch)
+
+        # shows progress without blocking the rest of the window
+        self.grid_progress_dialog = QProgressDialog("Loading regional grid...", "Cancel", 0, len(missing_cells), self)
+        self.grid_progress_dialog.setWindowTitle("Regional Grid")
+        self.grid_progress_dialog.setMinimumDuration(0)
+        self.grid_progress_dialog.setValue(0)
+        self.grid_fetch_thread.progress.connect(lambda done, total: self.grid_progress_dialog.setValue(done))
+        self.grid_progress_dialog.canceled.connect(self.cancel_grid_fetch)
+        self.grid_progress_dialog.show()
+
+        self.grid_fetch_thread.start()
+
+    def cancel_grid_fetch(self) -> None:
+        '''
+        Stops the running grid fetch. Cells fetched so far are still displayed
+        '''
+        # closing the dialog also cancels it, so this may run more than once
+        if self.grid_fetch_thread is None or self.grid_fetch_thread.stop_event.is_set():
+            return
+
+        self.grid_fetch_thread.stop_event.set()
+        # stops progress from reopening the dialog once it has been canceled
+        self.grid_fetch_thread.progress.disconnect()
+
+    def finish_grid_fetch(self) -> None:
+        '''
+        Collects the results of the worker thread once it has finished
+        '''
+        # the thread emits finished just before it stops, so wait for it to
+        # fully stop before it can be garbage collected
+        thread = self.grid_fetch_thread
+        thread.wait()
+        self.grid_fetch_thread = None
+        self.grid_progress_dialog.close()
+        self.grid_progress_dialog = None
+
+        self.finish_grid_update(thread.cell_data, thread.failed_cells)
+
+    def closeEvent(self, event) -> None:
+        '''
+        Stops any running grid fetch before the window closes, since the
+        thread cannot be destroyed while it is still running
+
+        :param event: the window's close event
+        '''
+        if self.grid_fetch_thread is not None:
+            # the window is closing, so nothing should be displayed afterwards
+            self.grid_fetch_thread.finished.disconnect()
+            self.grid_fetch_thread.stop_event.set()
+            self.grid_fetch_thread.wait()
+        event.accept()
+
+    def determine_grid_failure_cause(self, failed_cells: dict) -> str:
+        '''
+        Determines why regional grid requests failed
+
+        :param failed_cells: dictionary of failed cells to their failure reason
+        :return: a message describing the most likely cause
+        '''
+        reasons = set(failed_cells.values())
+        if 401 in reasons:
+            return "Problem with the API key! Make sure to double check it, or get one from <a href='https://openweathermap.org/price'>OpenWeatherMap</a>."
+        if 429 in reasons:
+            return "OpenWeatherMap's rate limit was reached! Wait a minute before loading or panning the grid again."
+        if reasons & {'Timeout', 'ConnectTimeout', 'ReadTimeout', 'ConnectionError'}:
+            return "Could not reach OpenWeatherMap! Make sure to double check your internet connection."
+        reasons_display = ', '.join(sorted(str(reason) for reason in reasons))
+        return f"OpenWeatherMap could not load these points ({reasons_display})."
+
+    def finish_grid_update(self, fetched_data: dict, failed_cells: dict) -> None:
+        '''
+        Caches newly fetched cells and displays the pending regional grid
+
+        :param fetched_data: dictionary of fetched cells to their weather data
+        :param failed_cells: dictionary of cells that failed to load to their
+                             failure reason
+        '''
+        bounds, lat_cells, lon_cells, units, cell_data = self.grid_pending
+        self.grid_pending = None
+
+        # failed requests are left out of the cache so they can be retried
+        self.grid_tile_cache.store(fetched_data, units, time.time())
+        cell_data.update(fetched_data)
+        if not cell_data:
+            # a canceled fetch with nothing to show needs no message
+            if failed_cells:
+                self.show_error_message(self.determine_grid_failure_cause(failed_cells))
+            return
+
+        self.grid_bounds = bounds
+        temperatures, precipitation, conditions = assemble_grid_arrays(lat_cells, lon_cells, cell_data)
+        self.grid_data = (temperatures, precipitation, conditions, units)
+        self.display_grid_heatmap()
+
+        # lets the user know the blank points in the heatmap are missing data
+        if failed_cells:
+            failed_points = int(np.isnan(temperatures).sum())
+            self.show_error_message(f"{failed_points} of {temperatures.size} points failed to load, and are left blank.<br>{self.determine_grid_failure_cause(failed_cells)}", "Warning!")
+
+    def render_grid_heatmap(self, values: np.ndarray, temperature_chart: bool=True) -> QImage:
+        '''
+        Creates a heatmap image with one pixel per grid point
+
+        :param values: array of temperature or precipitation values
+        :param temperature_chart: determines if the values are temperature or
+                                  precipitation. defaults to True
+        :return: the heatmap image
+        '''
+        rgb = np.ascontiguousarray(colorize_grid(values, temperature_chart))
+        rows, cols = values.shape
+        # copies the image so that it owns its data once the array is gone
+        return QImage(rgb.data, cols, rows, 3 * cols, QImage.Format_RGB888).copy()
+
+    def display_grid_heatmap(self, temperature_chart: bool=True) -> None:
+        '''
+        Displays the regional grid heatmap in place of the forecast linechart
+
+        :param temperature_chart: determines if the heatmap is a temperature or
+                                  precipitation heatmap. defaults to True
+        '''
+        if self.grid_data is None:
+            return
+
+        temperatures, precipitation, conditions, units = self.grid_data
+        values = precipitation
+        if temperature_chart:
+            values = temperatures
+
+        # keeps the grid's aspect ratio, centering it in the label
+        pixmap = QPixmap(self.regional_heatmap_label.size())
+        pixmap.fill(QColor(25, 35, 45))
+        heatmap = QPixmap.fromImage(self.render_grid_heatmap(values, temperature_chart)).scaled(pixmap.size(), Qt.KeepAspectRatio, Qt.FastTransformation)
+        left = (pixmap.width() - heatmap.width()) // 2
+        top = (pixmap.height() - heatmap.height()) // 2
+
+        painter = QPainter(pixmap)
+        painter.setRenderHint(QPainter.SmoothPixmapTransform)
+        painter.drawPixmap(left, top, heatmap)
+
+        # draws each point's weather using the same icons as the forecast,
+        # sized to the grid cells as long as they are large enough to fit them
+        rows, cols = values.shape
+        cell_width = heatmap.width() / cols
+        cell_height = heatmap.height() / rows
+        icon_size = int(min(cell_width, cell_height) * 0.8)
+        if icon_size >= GRID_MIN_ICON_SIZE:
+            icons = {}
+            for i in range(rows):
+                for j in range(cols):
+                    if conditions[i][j] is None:
+                        continue
+                    file = self.get_weather_icon_path(*conditions[i][j])
+                    if file not in icons:
+                        icons[file] = QPixmap(file).scaled(icon_size, icon_size, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+                    icon = icons[file]
+                    x = int(left + j * cell_width + (cell_width - icon.width()) / 2)
+                    y = int(top + i * cell_height + (cell_height - icon.height()) / 2)
+                    painter.drawPixmap(x, y, icon)
+
+        # labels the range of values the colors cover
+        if temperature_chart:
+            ending_units = "K"
+            if units == "metric":
+                ending_units = "°C"
+            elif units == "imperial":
+                ending_units = "°F"
+            range_display = f"{round(np.nanmin(values))}{ending_units} - {round(np.nanmax(values))}{ending_units}"
+        else:
+            range_display = f"0 - {np.nanmax(values):.1f} mm/h"
+        painter.setPen(Qt.white)
+        painter.drawText(pixmap.rect().adjusted(5, 5, -5, -5), Qt.AlignBottom | Qt.AlignRight, range_display)
+        painter.end()
+
+        self.regional_heatmap_label.setPixmap(pixmap)
+
+        self.temperature_forecast_chart.hide()
+        self.regional_heatmap_label.show()
+
+        # the heatmap shares the buttons of the forecast linechart
+        self.temperature_tool_button.show()
+        self.precipitation_tool_button.show()
+        self.region_tool_button.show()
+
     def save_data(self, default: bool=True) -> None:
         '''
         Grabs and saves data on-screen to a .json file
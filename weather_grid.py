@@ -0,0 +1,283 @@
+'''
+Regional weather grid helpers. Nothing in here touches Qt, so these can run
+on worker threads and be tested without a display
+'''
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import requests
+
+WEATHER_API_URL = "https://api.openweathermap.org/data/2.5/weather"
+
+# regional grid settings, all in degrees unless stated otherwise
+GRID_DEFAULT_SPAN = 2.0
+GRID_DEFAULT_RESOLUTION = 0.25
+# resolutions finer than the cache cell put several points in one cell
+GRID_MIN_RESOLUTION = 0.01
+GRID_MAX_POINTS = 2500
+# at most this many cache cells are requested for a single grid
+GRID_MAX_REQUESTS = 100
+# grid points that fall in the same cache cell share a single request
+GRID_CACHE_CELL = 0.05
+# cache cells are grouped into tiles so that panning only fetches new tiles
+GRID_TILE_SIZE = 1.0
+# OpenWeatherMap updates current conditions roughly every 10 minutes
+GRID_CACHE_TTL = 600
+GRID_MAX_WORKERS = 8
+# the free OpenWeatherMap plan allows 60 calls a minute. paid plans may raise this
+GRID_REQUESTS_PER_SECOND = 1
+
+# color stops for the regional heatmap, from the lowest to highest value
+TEMPERATURE_HEATMAP_STOPS = np.array([0.0, 0.33, 0.66, 1.0])
+TEMPERATURE_HEATMAP_COLORS = np.array([(49, 54, 149), (116, 173, 209), (254, 224, 144), (215, 48, 39)])
+PRECIPITATION_HEATMAP_STOPS = np.array([0.0, 1.0])
+PRECIPITATION_HEATMAP_COLORS = np.array([(25, 35, 45), (30, 90, 220)])
+# same color as the rest of the background
+HEATMAP_MISSING_COLOR = (25, 35, 45)
+
+class RateLimiter:
+    def __init__(self, calls_per_second: float):
+        '''
+        Spaces out calls shared between threads so that no more than a given
+        number of them start each second
+
+        :param calls_per_second: maximum number of calls started per second
+        '''
+        self.interval = 1 / calls_per_second
+        self.next_call = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self) -> None:
+        '''
+        Blocks the calling thread until it is allowed to make its call
+        '''
+        # reserves the next open slot, then sleeps outside the lock so other
+        # threads can reserve the slots after it
+        with self.lock:
+            now = time.monotonic()
+            wait_time = self.next_call - now
+            self.next_call = max(now, self.next_call) + self.interval
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+class GridTileCache:
+    def __init__(self, ttl: float=GRID_CACHE_TTL):
+        '''
+        Caches fetched weather per cache cell, grouped into tiles
+
+        :param ttl: seconds before a cached cell goes stale
+        '''
+        self.ttl = ttl
+        self.tiles = {}
+
+    def prune(self, now: float) -> None:
+        '''
+        Drops any cached cells that have gone stale, and any tiles left empty
+
+        :param now: current time in unix time
+        '''
+        for tile_key in list(self.tiles):
+            tile = {cell: entry for cell, entry in self.tiles[tile_key].items() if now - entry[0] < self.ttl}
+            if tile:
+                self.tiles[tile_key] = tile
+            else:
+                del self.tiles[tile_key]
+
+    def lookup(self, cells: set, units: str) -> tuple:
+        '''
+        Splits cache cells into those already cached and those still needed
+
+        :param cells: set of cache cells
+        :param units: selected units
+        :return: tuple of a dictionary of cached cells to their weather data
+                 and a list of cells that need to be fetched
+        '''
+        cell_data = {}
+        missing_cells = []
+        for cell in cells:
+            tile = self.tiles.get(get_grid_tile(cell, units), {})
+            if cell in tile:
+                cell_data[cell] = tile[cell][1]
+            else:
+                missing_cells.append(cell)
+        return cell_data, missing_cells
+
+    def store(self, cell_data: dict, units: str, now: float) -> None:
+        '''
+        Adds fetched cells to their tiles
+
+        :param cell_data: dictionary of cache cells to their weather data
+        :param units: selected units
+        :param now: time the data was fetched in unix time
+        '''
+        for cell, data in cell_data.items():
+            self.tiles.setdefault(get_grid_tile(cell, units), {})[cell] = (now, data)
+
+def build_grid_cells(bounds: tuple, resolution: float) -> tuple:
+    '''
+    Lays out grid points inside of a bounding box as cache cell indices
+
+    :param bounds: tuple of the south, west, north, and east edges of the grid
+    :param resolution: distance between grid points in degrees
+    :return: tuple of each row's latitude cell, ordered north to south, and
+             each column's longitude cell, ordered west to east. neighboring
+             rows or columns may share a cell
+    '''
+    south, west, north, east = bounds
+
+    # points are snapped to multiples of the resolution so that panned
+    # grids land on the same points, and therefore the same cached tiles
+    epsilon = 1e-9
+    lats = np.arange(math.ceil(south / resolution - epsilon), math.floor(north / resolution + epsilon) + 1) * resolution
+    lons = np.arange(math.ceil(west / resolution - epsilon), math.floor(east / resolution + epsilon) + 1) * resolution
+
+    lat_cells = np.rint(lats[::-1] / GRID_CACHE_CELL).astype(int)
+    lon_cells = np.rint(lons / GRID_CACHE_CELL).astype(int)
+    return lat_cells, lon_cells
+
+def get_grid_cells(lat_cells: np.ndarray, lon_cells: np.ndarray) -> set:
+    '''
+    Collects the unique cache cells covered by a grid
+
+    :param lat_cells: array of each row's latitude cell
+    :param lon_cells: array of each column's longitude cell
+    :return: set of cache cells, each of which only needs one request
+    '''
+    return {(int(lat_cell), int(lon_cell)) for lat_cell in lat_cells for lon_cell in lon_cells}
+
+def get_grid_tile(cell: tuple, units: str) -> tuple:
+    '''
+    Determines which cache tile a cache cell belongs to
+
+    :param cell: tuple of the latitude and longitude cell indices
+    :param units: selected units
+    :return: tuple identifying the tile
+    '''
+    lat_cell, lon_cell = cell
+    return (math.floor(lat_cell * GRID_CACHE_CELL / GRID_TILE_SIZE), math.floor(lon_cell * GRID_CACHE_CELL / GRID_TILE_SIZE), units)
+
+def fetch_grid_point(cell: tuple, api_key: str, units: str) -> tuple:
+    '''
+    Requests current weather at the center of a cache cell
+
+    :param cell: tuple of the latitude and longitude cell indices
+    :param api_key: given api_key
+    :param units: selected units
+    :return: tuple of the weather data and failure reason. the weather data
+             is a tuple of the temperature, precipitation, and the weather
+             icon fields, or None if the request failed. the failure reason is
+             the HTTP status code or exception name, or None on success
+    '''
+    lat = cell[0] * GRID_CACHE_CELL
+    lon = cell[1] * GRID_CACHE_CELL
+    try:
+        weather_api_request = requests.get(WEATHER_API_URL + f"?lat={lat:.4f}&lon={lon:.4f}&appid={api_key}&units={units}", timeout=10)
+        # rejected requests, such as a bad api key or the rate limit, keep their status code
+        if not weather_api_request:
+            return None, weather_api_request.status_code
+        api = weather_api_request.json()
+
+        # precipitation is the rain and snow volume over the last hour, in mm
+        precipitation = api.get('rain', {}).get('1h', 0) + api.get('snow', {}).get('1h', 0)
+        return (api['main']['temp'], precipitation, api['weather'][0]['main'], api['dt'], api['sys']['sunrise'], api['sys']['sunset'], api['clouds']['all']), None
+    except (requests.exceptions.RequestException, KeyError, ValueError) as e:
+        return None, type(e).__name__
+
+def fetch_grid_cells(cells: list, api_key: str, units: str, limiter: RateLimiter, progress=None, stop: threading.Event=None) -> tuple:
+    '''
+    Fetches current weather for several cache cells concurrently
+
+    :param cells: list of cache cells to fetch
+    :param api_key: given api_key
+    :param units: selected units
+    :param limiter: rate limiter shared by every request
+    :param progress: optional callable given the number of finished and
+                     total requests after each one finishes
+    :param stop: optional event that skips any requests not yet made once set
+    :return: tuple of a dictionary of fetched cells to their weather data and
+             a dictionary of failed cells to their failure reason. skipped
+             cells are in neither
+    '''
+    if stop is None:
+        stop = threading.Event()
+
+    def fetch(cell: tuple) -> tuple:
+        # checks both before and after waiting, since the wait may be long
+        if stop.is_set():
+            return None, None
+        limiter.wait()
+        if stop.is_set():
+            return None, None
+        return fetch_grid_point(cell, api_key, units)
+
+    cell_data = {}
+    failed_cells = {}
+    with ThreadPoolExecutor(max_workers=GRID_MAX_WORKERS) as executor:
+        for i, (cell, (data, reason)) in enumerate(zip(cells, executor.map(fetch, cells))):
+            if data is not None:
+                cell_data[cell] = data
+            elif reason is not None:
+                failed_cells[cell] = reason
+            if progress is not None:
+                progress(i + 1, len(cells))
+
+    return cell_data, failed_cells
+
+def assemble_grid_arrays(lat_cells: np.ndarray, lon_cells: np.ndarray, cell_data: dict) -> tuple:
+    '''
+    Assembles fetched weather data into arrays laid out like the grid
+
+    :param lat_cells: array of each row's latitude cell, ordered north to south
+    :param lon_cells: array of each column's longitude cell, ordered west to east
+    :param cell_data: dictionary of cache cells to their weather data
+    :return: tuple of the temperature array, precipitation array, and a list
+             of lists of weather icon fields. missing points are NaN in the
+             arrays and None in the list
+    '''
+    rows, cols = len(lat_cells), len(lon_cells)
+    temperatures = np.full((rows, cols), np.nan)
+    precipitation = np.full((rows, cols), np.nan)
+    conditions = [[None] * cols for _ in range(rows)]
+
+    for i in range(rows):
+        for j in range(cols):
+            data = cell_data.get((int(lat_cells[i]), int(lon_cells[j])))
+            if data is None:
+                continue
+            temperatures[i, j] = data[0]
+            precipitation[i, j] = data[1]
+            conditions[i][j] = data[2:]
+
+    return temperatures, precipitation, conditions
+
+def colorize_grid(values: np.ndarray, temperature_chart: bool=True) -> np.ndarray:
+    '''
+    Colors grid values for the heatmap, one pixel per grid point
+
+    :param values: array of temperature or precipitation values
+    :param temperature_chart: determines if the values are temperature or
+                              precipitation. defaults to True
+    :return: array of RGB colors with the same rows and columns as the grid
+    '''
+    missing = np.isnan(values)
+
+    # scales values to 0-1. precipitation is kept relative to zero so that
+    # dry areas always look dry
+    if temperature_chart:
+        stops, colors = TEMPERATURE_HEATMAP_STOPS, TEMPERATURE_HEATMAP_COLORS
+        low, high = np.nanmin(values), np.nanmax(values)
+        normalized = (values - low) / max(high - low, 1)
+    else:
+        stops, colors = PRECIPITATION_HEATMAP_STOPS, PRECIPITATION_HEATMAP_COLORS
+        normalized = values / max(np.nanmax(values), 1)
+    normalized = np.nan_to_num(normalized)
+
+    # interpolates every channel of every point at once
+    rgb = np.empty(values.shape + (3,), dtype=np.uint8)
+    for channel in range(3):
+        rgb[..., channel] = np.interp(normalized, stops, colors[:, channel])
+    rgb[missing] = HEATMAP_MISSING_COLOR
+
+    return rgb